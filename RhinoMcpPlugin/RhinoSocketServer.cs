@@ -1,4 +1,6 @@
 using System;
+using System.Buffers.Binary;
+using System.Collections.Generic;
 using System.Net;
 using System.Net.Sockets;
 using System.Text;
@@ -13,9 +15,14 @@ namespace RhinoMcpPlugin
     public class RhinoSocketServer
     {
         private TcpListener _listener;
-        private bool _isRunning;
+        private volatile bool _isRunning;
         private readonly int _port;
         private readonly ManualResetEvent _stopEvent = new ManualResetEvent(false);
+        // Clients stay connected between commands, so Stop() has to close them itself
+        private readonly HashSet<TcpClient> _clients = new HashSet<TcpClient>();
+        
+        // Upper bound for a framed message - anything larger is a corrupt or unframed header
+        private const int MaxMessageSize = 16 * 1024 * 1024;
         
         // Default port for communication
         public RhinoSocketServer(int port = 9876)
@@ -43,6 +50,16 @@ namespace RhinoMcpPlugin
             _listener?.Stop();
             _stopEvent.Set();
             
+            // Closing the clients unblocks handlers waiting in Read
+            lock (_clients)
+            {
+                foreach (var client in _clients)
+                {
+                    client.Close();
+                }
+                _clients.Clear();
+            }
+            
             RhinoApp.WriteLine("RhinoMcpPlugin: Socket server stopped");
         }
         
@@ -101,32 +118,87 @@ namespace RhinoMcpPlugin
         
         private void HandleClient(TcpClient client)
         {
+            lock (_clients)
+            {
+                // Stop() may have run between accepting the client and getting here
+                if (!_isRunning)
+                {
+                    client.Close();
+                    return;
+                }
+                _clients.Add(client);
+            }
+            
             using (client)
             {
                 try
                 {
                     var stream = client.GetStream();
-                    var buffer = new byte[4096];
-                    
-                    // Read message
-                    int bytesRead = stream.Read(buffer, 0, buffer.Length);
-                    if (bytesRead == 0) return;
-                    
-                    var message = Encoding.UTF8.GetString(buffer, 0, bytesRead);
-                    RhinoApp.WriteLine($"RhinoMcpPlugin: Received command: {message}");
+                    var header = new byte[4];
                     
-                    // Parse and execute command
-                    var response = ProcessCommand(message);
-                    
-                    // Send response
-                    var responseBytes = Encoding.UTF8.GetBytes(response);
-                    stream.Write(responseBytes, 0, responseBytes.Length);
+                    // Keep serving commands on this connection until the client disconnects,
+                    // so the MCP server can reuse one socket instead of reconnecting per command.
+                    // Each message is framed with a 4-byte big-endian length prefix.
+                    while (_isRunning)
+                    {
+                        // Read message
+                        if (!ReadExactly(stream, header, header.Length)) return;
+                        int length = BinaryPrimitives.ReadInt32BigEndian(header);
+                        if (length < 0 || length > MaxMessageSize)
+                        {
+                            RhinoApp.WriteLine($"RhinoMcpPlugin: Invalid message length {length}, closing connection");
+                            return;
+                        }
+                        
+                        var payload = new byte[length];
+                        if (!ReadExactly(stream, payload, length)) return;
+                        
+                        // Don't execute a command that arrived while the server was stopping
+                        if (!_isRunning) return;
+                        
+                        var message = Encoding.UTF8.GetString(payload);
+                        RhinoApp.WriteLine($"RhinoMcpPlugin: Received command: {message}");
+                        
+                        // Parse and execute command
+                        var response = ProcessCommand(message);
+                        
+                        // Send response
+                        var responseBytes = Encoding.UTF8.GetBytes(response);
+                        var frame = new byte[4 + responseBytes.Length];
+                        BinaryPrimitives.WriteInt32BigEndian(frame, responseBytes.Length);
+                        responseBytes.CopyTo(frame, 4);
+                        stream.Write(frame, 0, frame.Length);
+                    }
                 }
                 catch (Exception ex)
                 {
-                    RhinoApp.WriteLine($"RhinoMcpPlugin: Error handling client: {ex.Message}");
+                    // Stop() closing the connection is expected, not an error
+                    if (_isRunning)
+                    {
+                        RhinoApp.WriteLine($"RhinoMcpPlugin: Error handling client: {ex.Message}");
+                    }
                 }
+                finally
+                {
+                    lock (_clients)
+                    {
+                        _clients.Remove(client);
+                    }
+                }
+            }
+        }
+        
+        private static bool ReadExactly(NetworkStream stream, byte[] buffer, int count)
+        {
+            // Returns false if the client closed the connection before count bytes arrived
+            int offset = 0;
+            while (offset < count)
+            {
+                int bytesRead = stream.Read(buffer, offset, count - offset);
+                if (bytesRead == 0) return false;
+                offset += bytesRead;
             }
+            return true;
         }
         
         private string ProcessCommand(string message)
@@ -10,14 +10,17 @@ import os
 import sys
 import time
 import logging
+import logging.handlers
+import queue
+import atexit
 import signal
 import threading
-import traceback
 from datetime import datetime
 import re
 import uuid
 import asyncio
 import socket
+import struct
 from typing import Dict, Any, List, Optional, Tuple
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
@@ -25,6 +28,12 @@ from typing import AsyncIterator
 # Import the FastMCP class
 from mcp.server.fastmcp import FastMCP, Context
 
+# orjson is optional - used for encoding commands and decoding Rhino's responses
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging - improved with structured format and unified location
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
 os.makedirs(log_dir, exist_ok=True)
@@ -42,13 +51,27 @@ today = datetime.now().strftime("%Y-%m-%d")
 server_log_file = os.path.join(server_log_dir, f"server_{today}.log")
 debug_log_file = os.path.join(server_log_dir, f"debug_{today}.log")
 
-# Set up the logger with custom format including timestamp, level, component, and message
+# Set up the logger with custom format including timestamp, level, component, and message.
+# Records are handed to a background listener so Rhino requests never block on log I/O.
+log_queue = queue.SimpleQueue()
+log_formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] [%(component)s] %(message)s')
+
+# Add a debug file handler for detailed debugging
+debug_handler = logging.FileHandler(debug_log_file, delay=True)
+debug_handler.setLevel(logging.DEBUG)
+
+log_handlers = [logging.StreamHandler(sys.stderr), logging.FileHandler(server_log_file, delay=True), debug_handler]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
-    format='[%(asctime)s] [%(levelname)s] [%(component)s] %(message)s',
+    format='%(message)s',  # Full formatting happens on the listener thread
     handlers=[
-        logging.StreamHandler(sys.stderr),
-        logging.FileHandler(server_log_file)
+        logging.handlers.QueueHandler(log_queue)
     ]
 )
 
@@ -66,12 +89,6 @@ class ComponentFilter(logging.Filter):
 logger = logging.getLogger()
 logger.addFilter(ComponentFilter())
 
-# Add a debug file handler for detailed debugging
-debug_handler = logging.FileHandler(debug_log_file)
-debug_handler.setLevel(logging.DEBUG)
-debug_handler.setFormatter(logging.Formatter('[%(asctime)s] [%(levelname)s] [%(component)s] %(message)s'))
-logger.addHandler(debug_handler)
-
 # Log basic server startup information
 logger.info(f"RhinoMCP server starting in {os.getcwd()}")
 logger.info(f"Log files directory: {log_dir}")
@@ -87,6 +104,33 @@ logger.info(f"Server PID: {os.getpid()}")
 # Global Rhino connection
 _rhino_connection = None
 
+# Rhino runs on the same machine, so a connect that takes longer than this means it isn't listening
+RHINO_CONNECT_TIMEOUT = 2.0
+# Commands execute on Rhino's UI thread and can legitimately take a while
+RHINO_RESPONSE_TIMEOUT = 10.0
+
+# JSON codec for the Rhino request/response path, picked once at import
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps_bytes = orjson.dumps
+else:
+    def json_loads(data):
+        """Parse JSON from bytes or a memoryview (json.loads rejects the latter)"""
+        return json.loads(str(data, 'utf-8'))
+    
+    def json_dumps_bytes(data) -> bytes:
+        """Serialize data to compact JSON bytes"""
+        return json.dumps(data).encode('utf-8')
+
+# Upper bound for a framed Rhino response - anything larger is a corrupt or unframed header
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Initial size of the reusable response buffer, doubled when a larger response arrives
+RHINO_RESPONSE_BUFFER_SIZE = 65536
+
+# Serialized command heads per command type, e.g. b'{"type": "create_sphere", "params": '
+COMMAND_PREFIXES = {}
+
 class RhinoConnection:
     """Class to manage socket connection to Rhino plugin"""
     
@@ -95,6 +139,11 @@ class RhinoConnection:
         self.port = port
         self.sock = None
         self.request_id = 0
+        # Length-prefix header, reused for every response
+        self.header = bytearray(4)
+        self.header_view = memoryview(self.header)
+        # Response payloads are received into this buffer instead of a new one per command
+        self.buffer = bytearray(RHINO_RESPONSE_BUFFER_SIZE)
     
     def connect(self) -> bool:
         """Connect to the Rhino plugin socket server"""
@@ -103,12 +152,17 @@ class RhinoConnection:
             
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Commands are small request/response pairs - don't let Nagle hold them back
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self.sock.settimeout(RHINO_CONNECT_TIMEOUT)
             self.sock.connect((self.host, self.port))
+            self.sock.settimeout(RHINO_RESPONSE_TIMEOUT)
             logger.info(f"Connected to Rhino at {self.host}:{self.port}")
             return True
         except Exception as e:
             logger.error(f"Failed to connect to Rhino: {str(e)}")
-            logger.debug(f"Connection error details: {traceback.format_exc()}")
+            logger.debug("Connection error details", exc_info=True)
             self.sock = None
             return False
     
@@ -122,8 +176,77 @@ class RhinoConnection:
             finally:
                 self.sock = None
     
-    def send_command(self, command_type: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Send a command to Rhino and return the response"""
+    def _recv_exact_into(self, view: memoryview) -> int:
+        """Fill view from the socket, returning how many bytes arrived before EOF"""
+        received = 0
+        while received < len(view):
+            n = self.sock.recv_into(view[received:])
+            if not n:
+                break
+            received += n
+        return received
+    
+    def _receive_response(self) -> Optional[memoryview]:
+        """Read one length-prefixed JSON response from the socket
+        
+        Returns a view into the connection's reusable buffer, which is only
+        valid until the next command, or None if Rhino closed the connection
+        before sending anything.
+        """
+        received = self._recv_exact_into(self.header_view)
+        if received == 0:
+            return None
+        if received < 4:
+            raise ConnectionError("Connection closed while reading response header")
+        
+        length = struct.unpack(">I", self.header)[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise ConnectionError(f"Invalid response length {length} - is the Rhino plugin up to date?")
+        if length > len(self.buffer):
+            self.buffer = bytearray(min(max(length, 2 * len(self.buffer)), MAX_MESSAGE_SIZE))
+        response_data = memoryview(self.buffer)[:length]
+        if self._recv_exact_into(response_data) < length:
+            raise ConnectionError(f"Connection closed after partial response ({length} bytes expected)")
+        
+        return response_data
+    
+    def _peer_closed(self) -> bool:
+        """Check without blocking whether Rhino has closed the cached socket"""
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) == b""
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self.sock.settimeout(timeout)
+    
+    def _exchange(self, payload: bytes) -> Optional[memoryview]:
+        """Send a command over the persistent socket and return the raw response
+        
+        Messages in both directions carry a 4-byte big-endian length prefix.
+        A socket Rhino closed since the last command is replaced before
+        sending; once the frame is written it is never resent, so a command
+        cannot run twice.
+        """
+        if self._peer_closed():
+            logger.info("Rhino connection was closed, reconnecting")
+            self.disconnect()
+            if not self.connect():
+                raise ConnectionError("Could not reconnect to Rhino")
+        
+        self.sock.sendall(struct.pack(">I", len(payload)) + payload)
+        return self._receive_response()
+    
+    def send_command(self, command_type: str, params: Dict[str, Any] = None, as_json: bool = False) -> Any:
+        """Send a command to Rhino and return the response
+        
+        With as_json=True the result is returned as JSON text; when Rhino's
+        response is itself the result, its raw text is passed through
+        without being serialized again.
+        """
         if not self.sock and not self.connect():
             raise ConnectionError("Not connected to Rhino")
         
@@ -131,114 +254,81 @@ class RhinoConnection:
         self.request_id += 1
         current_request_id = self.request_id
         
-        command = {
-            "id": current_request_id,
-            "type": command_type,
-            "params": params or {}
-        }
-        
         try:
             # Log the command being sent
             logger.info(f"Request #{current_request_id}: Sending command '{command_type}' to Rhino")
-            logger.debug(f"Request #{current_request_id} Parameters: {json.dumps(params or {})}")
-            
-            # Send the command
-            command_json = json.dumps(command)
-            logger.debug(f"Request #{current_request_id} Raw command: {command_json}")
-            self.sock.sendall(command_json.encode('utf-8'))
+            logger.debug("Request #%s Parameters: %s", current_request_id, params or {})
             
-            # Set a timeout for receiving
-            self.sock.settimeout(10.0)
+            # Build the command bytes directly from the cached head and the parameters
+            prefix = COMMAND_PREFIXES.get(command_type)
+            if prefix is None:
+                prefix = COMMAND_PREFIXES[command_type] = ('{"type": ' + json.dumps(command_type) + ', "params": ').encode('utf-8')
+            payload = b"".join((prefix, json_dumps_bytes(params or {}), b', "id": %d}' % current_request_id))
+            logger.debug("Request #%s Raw command: %s", current_request_id, payload)
             
-            # Receive the response
-            buffer_size = 4096
-            response_data = b""
-            
-            while True:
-                chunk = self.sock.recv(buffer_size)
-                if not chunk:
-                    break
-                response_data += chunk
-                
-                # Try to parse as JSON to see if we have a complete response
-                try:
-                    json.loads(response_data.decode('utf-8'))
-                    # If parsing succeeds, we have a complete response
-                    break
-                except json.JSONDecodeError:
-                    # Not a complete JSON yet, continue receiving
-                    continue
+            # Send the command
+            response_data = self._exchange(payload)
             
-            if not response_data:
+            if response_data is None:
                 logger.error(f"Request #{current_request_id}: No data received from Rhino")
                 raise ConnectionError(f"Request #{current_request_id}: No data received from Rhino")
             
             # Log the raw response for debugging
-            raw_response = response_data.decode('utf-8')
-            logger.debug(f"Request #{current_request_id} Raw response: {raw_response}")
-            
-            response = json.loads(raw_response)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Request #%s Raw response: %s", current_request_id, str(response_data, 'utf-8'))
             
-            # Check if the response indicates an error
-            if "error" in response:
-                error_msg = response.get("error", "Unknown error from Rhino")
-                logger.error(f"Request #{current_request_id}: Rhino reported error: {error_msg}")
-                raise Exception(f"Request #{current_request_id}: Rhino error: {error_msg}")
-            
-            if response.get("status") == "error":
-                error_msg = response.get("message", "Unknown error from Rhino")
-                logger.error(f"Request #{current_request_id}: Rhino reported error status: {error_msg}")
-                raise Exception(f"Request #{current_request_id}: Rhino error: {error_msg}")
-            
-            # Log success
-            logger.info(f"Request #{current_request_id}: Command '{command_type}' executed successfully")
-            
-            # If we get here, assume success and return the result
-            if "result" in response:
-                return response.get("result", {})
-            else:
-                # If there's no result field but no error either, return the whole response
-                return response
+            response = json_loads(response_data)
         except socket.timeout:
             logger.error(f"Request #{current_request_id}: Socket timeout while waiting for response from Rhino")
-            logger.debug(f"Request #{current_request_id}: Timeout after 10 seconds waiting for response to '{command_type}'")
-            self.sock = None
+            logger.debug("Request #%s: Timeout after %s seconds waiting for response to '%s'", current_request_id, RHINO_RESPONSE_TIMEOUT, command_type)
+            self.disconnect()
             raise Exception(f"Request #{current_request_id}: Timeout waiting for Rhino response")
         except (ConnectionError, BrokenPipeError, ConnectionResetError) as e:
             logger.error(f"Request #{current_request_id}: Socket connection error: {str(e)}")
-            self.sock = None
+            self.disconnect()
             raise Exception(f"Request #{current_request_id}: Connection to Rhino lost: {str(e)}")
         except json.JSONDecodeError as e:
             logger.error(f"Request #{current_request_id}: Invalid JSON response: {str(e)}")
             if 'response_data' in locals():
-                logger.error(f"Request #{current_request_id}: Raw response causing JSON error: {response_data[:200]}")
-            self.sock = None
+                logger.error(f"Request #{current_request_id}: Raw response causing JSON error: {bytes(response_data[:200])}")
+            self.disconnect()
             raise Exception(f"Request #{current_request_id}: Invalid JSON response from Rhino: {str(e)}")
         except Exception as e:
-            logger.error(f"Request #{current_request_id}: Error communicating with Rhino: {str(e)}")
-            logger.error(f"Request #{current_request_id}: Traceback: {traceback.format_exc()}")
-            self.sock = None
+            logger.exception(f"Request #{current_request_id}: Error communicating with Rhino: {str(e)}")
+            self.disconnect()
             raise Exception(f"Request #{current_request_id}: Communication error with Rhino: {str(e)}")
+        
+        # Check if the response indicates an error - raised outside the try since
+        # the connection itself is fine and stays open for the next command
+        if "error" in response:
+            error_msg = response.get("error", "Unknown error from Rhino")
+            logger.error(f"Request #{current_request_id}: Rhino reported error: {error_msg}")
+            raise Exception(f"Request #{current_request_id}: Rhino error: {error_msg}")
+        
+        if response.get("status") == "error":
+            error_msg = response.get("message", "Unknown error from Rhino")
+            logger.error(f"Request #{current_request_id}: Rhino reported error status: {error_msg}")
+            raise Exception(f"Request #{current_request_id}: Rhino error: {error_msg}")
+        
+        # Log success
+        logger.info(f"Request #{current_request_id}: Command '{command_type}' executed successfully")
+        
+        # If we get here, assume success and return the result
+        if "result" in response:
+            result = response.get("result", {})
+            return json_dumps_bytes(result).decode('utf-8') if as_json else result
+        else:
+            # If there's no result field but no error either, return the whole response
+            return str(response_data, 'utf-8') if as_json else response
 
 def get_rhino_connection() -> RhinoConnection:
     """Get or create a connection to Rhino"""
     global _rhino_connection
     
-    # If we have an existing connection, check if it's still valid
+    # Reuse the existing connection - send_command reconnects on its own if
+    # the socket has gone stale, so there is no need to probe it on every call
     if _rhino_connection is not None:
-        try:
-            # Don't use ping as it's not implemented in the Rhino plugin
-            # Instead, try get_scene_info which is more likely to work
-            _rhino_connection.send_command("get_scene_info", {})
-            return _rhino_connection
-        except Exception as e:
-            # Connection is dead, close it and create a new one
-            logger.warning(f"Existing connection is no longer valid: {str(e)}")
-            try:
-                _rhino_connection.disconnect()
-            except:
-                pass
-            _rhino_connection = None
+        return _rhino_connection
     
     # Create a new connection if needed
     if _rhino_connection is None:
@@ -342,16 +432,15 @@ def create_sphere(
         if color:
             params["color"] = color
             
-        result = rhino.send_command("create_sphere", params)
+        result = rhino.send_command("create_sphere", params, as_json=True)
         
         # Log success
         logger.info(f"[{tool_id}] Sphere created successfully")
         
         # Return the result
-        return json.dumps(result)
+        return result
     except Exception as e:
-        logger.error(f"[{tool_id}] Error creating sphere: {str(e)}")
-        logger.error(f"[{tool_id}] Traceback: {traceback.format_exc()}")
+        logger.exception(f"[{tool_id}] Error creating sphere: {str(e)}")
         return json.dumps({
             "success": False,
             "error": f"Error creating sphere: {str(e)}"
@@ -403,16 +492,15 @@ def create_box(
         if color:
             params["color"] = color
             
-        result = rhino.send_command("create_box", params)
+        result = rhino.send_command("create_box", params, as_json=True)
         
         # Log success
         logger.info(f"[{tool_id}] Box created successfully")
         
         # Return the result
-        return json.dumps(result)
+        return result
     except Exception as e:
-        logger.error(f"[{tool_id}] Error creating box: {str(e)}")
-        logger.error(f"[{tool_id}] Traceback: {traceback.format_exc()}")
+        logger.exception(f"[{tool_id}] Error creating box: {str(e)}")
         return json.dumps({
             "success": False,
             "error": f"Error creating box: {str(e)}",
@@ -462,16 +550,15 @@ def create_cylinder(
         if color:
             params["color"] = color
             
-        result = rhino.send_command("create_cylinder", params)
+        result = rhino.send_command("create_cylinder", params, as_json=True)
         
         # Log success
         logger.info(f"[{tool_id}] Cylinder created successfully")
         
         # Return the result
-        return json.dumps(result)
+        return result
     except Exception as e:
-        logger.error(f"[{tool_id}] Error creating cylinder: {str(e)}")
-        logger.error(f"[{tool_id}] Traceback: {traceback.format_exc()}")
+        logger.exception(f"[{tool_id}] Error creating cylinder: {str(e)}")
         return json.dumps({
             "success": False,
             "error": f"Error creating cylinder: {str(e)}",
@@ -494,16 +581,15 @@ def get_scene_info(ctx: Context) -> str:
         rhino = get_rhino_connection()
         
         # Send the command to Rhino
-        result = rhino.send_command("get_scene_info", {})
+        result = rhino.send_command("get_scene_info", {}, as_json=True)
         
         # Log success
         logger.info(f"[{tool_id}] Scene info retrieved successfully")
         
         # Return the result
-        return json.dumps(result)
+        return result
     except Exception as e:
-        logger.error(f"[{tool_id}] Error getting scene info: {str(e)}")
-        logger.error(f"[{tool_id}] Traceback: {traceback.format_exc()}")
+        logger.exception(f"[{tool_id}] Error getting scene info: {str(e)}")
         return json.dumps({
             "success": False,
             "error": f"Error getting scene info: {str(e)}",
@@ -534,16 +620,15 @@ def clear_scene(ctx: Context, currentLayerOnly: bool = False) -> str:
             "currentLayerOnly": currentLayerOnly
         }
         
-        result = rhino.send_command("clear_scene", params)
+        result = rhino.send_command("clear_scene", params, as_json=True)
         
         # Log success
         logger.info(f"[{tool_id}] Scene cleared successfully ({layer_info})")
         
         # Return the result
-        return json.dumps(result)
+        return result
     except Exception as e:
-        logger.error(f"[{tool_id}] Error clearing scene: {str(e)}")
-        logger.error(f"[{tool_id}] Traceback: {traceback.format_exc()}")
+        logger.exception(f"[{tool_id}] Error clearing scene: {str(e)}")
         return json.dumps({
             "success": False,
             "error": f"Error clearing scene: {str(e)}",
@@ -578,16 +663,15 @@ def create_layer(ctx: Context, name: str, color: Optional[str] = None) -> str:
         if color:
             params["color"] = color
             
-        result = rhino.send_command("create_layer", params)
+        result = rhino.send_command("create_layer", params, as_json=True)
         
         # Log success
         logger.info(f"[{tool_id}] Layer '{name}' created successfully")
         
         # Return the result
-        return json.dumps(result)
+        return result
     except Exception as e:
-        logger.error(f"[{tool_id}] Error creating layer: {str(e)}")
-        logger.error(f"[{tool_id}] Traceback: {traceback.format_exc()}")
+        logger.exception(f"[{tool_id}] Error creating layer: {str(e)}")
         return json.dumps({
             "success": False,
             "error": f"Error creating layer: {str(e)}",
@@ -627,7 +711,7 @@ def log_claude_message(
         elif type == "warning":
             logger.warning(f"[Claude] [{log_id}] {message[:100]}...")
         elif type == "debug":
-            logger.debug(f"[Claude] [{log_id}] {message[:100]}...")
+            logger.debug("[Claude] [%s] %.100s...", log_id, message)
         else:
             logger.info(f"[Claude] [{log_id}] {message[:100]}...")
         
@@ -654,8 +738,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received")
     except Exception as e:
-        logger.error(f"Error running server: {str(e)}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.exception(f"Error running server: {str(e)}")
     finally:
         logger.info("Server shutting down...")
         
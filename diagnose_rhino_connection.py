@@ -5,12 +5,12 @@ Diagnostic script for testing connection to Rhino
 
 import socket
 import json
+import struct
 import sys
 import time
 import os
 import logging
 from datetime import datetime
-import traceback
 
 # Configure diagnostic logging to use the same structure as the server
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
@@ -34,6 +34,16 @@ logging.basicConfig(
 logger = logging.getLogger()
 print(f"Logging diagnostic results to: {diagnostic_log_file}")
 
+def recv_exact(s, count):
+    """Receive exactly count bytes, or fewer if the connection closes"""
+    data = b""
+    while len(data) < count:
+        chunk = s.recv(count - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
 def send_command(command_type, params=None):
     """Send a command to Rhino and return the response"""
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -51,30 +61,23 @@ def send_command(command_type, params=None):
         
         command_json = json.dumps(command)
         logger.info(f"Sending command: {command_json}")
-        s.sendall(command_json.encode('utf-8'))
+        # Messages are framed with a 4-byte big-endian length prefix
+        payload = command_json.encode('utf-8')
+        s.sendall(struct.pack(">I", len(payload)) + payload)
         
         # Set a timeout for receiving
         s.settimeout(10.0)
         
         # Receive the response
-        buffer_size = 4096
-        response_data = b""
-        
         logger.info("Waiting for response...")
-        while True:
-            chunk = s.recv(buffer_size)
-            if not chunk:
-                break
-            response_data += chunk
-            
-            # Try to parse as JSON to see if we have a complete response
-            try:
-                json.loads(response_data.decode('utf-8'))
-                # If parsing succeeds, we have a complete response
-                break
-            except json.JSONDecodeError:
-                # Not a complete JSON yet, continue receiving
-                continue
+        header = recv_exact(s, 4)
+        if len(header) < 4:
+            raise ConnectionError("Connection closed before a response was received")
+        length = struct.unpack(">I", header)[0]
+        logger.info(f"Response length: {length} bytes")
+        response_data = recv_exact(s, length)
+        if len(response_data) < length:
+            raise ConnectionError(f"Connection closed after {len(response_data)} of {length} response bytes")
         
         logger.info("Raw response from Rhino:")
         logger.info(response_data.decode('utf-8'))
@@ -107,16 +110,14 @@ def send_command(command_type, params=None):
                 "result": response.get("result", response)
             }
         except Exception as e:
-            logger.error(f"Error parsing response: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception(f"Error parsing response: {e}")
             return {
                 "success": False,
                 "error": f"Error parsing response: {e}"
             }
     
     except Exception as e:
-        logger.error(f"Communication error: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Communication error: {e}")
         return {
             "success": False,
             "error": f"Communication error: {e}"
@@ -144,8 +145,7 @@ def main():
         socket_success = True
     except Exception as e:
         print(f"❌ Socket connection failed: {e}")
-        logger.error(f"Socket connection test: FAILED - {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Socket connection test: FAILED - {e}")
         print("Make sure Rhino is running and the plugin is loaded")
         socket_success = False
         
@@ -220,7 +220,6 @@ if __name__ == "__main__":
         success = main()
         sys.exit(0 if success else 1)
     except Exception as e:
-        logger.error(f"Unhandled exception in diagnostic tool: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Unhandled exception in diagnostic tool: {e}")
         print(f"\n❌ Error running diagnostic: {e}")
         sys.exit(1) 
\ No newline at end of file
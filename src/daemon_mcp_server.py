@@ -10,30 +10,27 @@ import os
 import socket
 import sys
 import time
+import atexit
 import logging
 import signal
 import threading
-import traceback
-from datetime import datetime
 import socketserver
 
+from mcp_common import (
+    RESPONSE_PREFIX, encode_id, error_response, init_response_suffix,
+    json_dumps_line, json_loads, setup_logging, shutdown_response, tool_response
+)
+
 # Configure logging - log to both stderr and a file
 log_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(log_dir)
 log_file = os.path.join(root_dir, "logs", "daemon_mcp_server.log")
 os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] [%(levelname)s] %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stderr),
-        logging.FileHandler(log_file)
-    ]
-)
+setup_logging(logging.StreamHandler(sys.stderr), logging.FileHandler(log_file, delay=True))
 
 # Global variables
-EXIT_FLAG = False
+EXIT_EVENT = threading.Event()  # Set to trigger a graceful shutdown
 SERVER_STATE = "waiting"  # States: waiting, initialized, processing
 SOCKET_PORT = 8765  # Port for the socket server
 
@@ -110,6 +107,10 @@ SERVER_CAPABILITIES = {
     }
 }
 
+# The capabilities never change, so the initialize response is serialized once
+# and only the request ID is spliced in per request
+INIT_RESPONSE_SUFFIX = init_response_suffix(SERVER_CAPABILITIES)
+
 class MCPRequestHandler(socketserver.BaseRequestHandler):
     """
     Handler for MCP requests over a TCP socket
@@ -118,11 +119,13 @@ class MCPRequestHandler(socketserver.BaseRequestHandler):
         """Handle requests from a client"""
         self.client_connected = True
         self.local_state = "waiting"
+        # Responses to one batch of messages are collected here and sent together
+        self.pending = bytearray()
         logging.info(f"Client connected from {self.client_address}")
         
         try:
-            buffer = b""
-            while not EXIT_FLAG and self.client_connected:
+            buffer = bytearray()
+            while not EXIT_EVENT.is_set() and self.client_connected:
                 try:
                     # Read data from socket
                     data = self.request.recv(4096)
@@ -135,65 +138,45 @@ class MCPRequestHandler(socketserver.BaseRequestHandler):
                     # Add received data to buffer
                     buffer += data
                     
-                    # Process complete messages (assuming each message ends with newline)
-                    while b'\n' in buffer:
-                        line, buffer = buffer.split(b'\n', 1)
-                        if line:
-                            line_str = line.decode('utf-8')
-                            self.process_message(line_str)
+                    # Process every complete message (each ends with a newline) and
+                    # answer the whole batch with a single send
+                    end = buffer.rfind(b'\n')
+                    if end < 0:
+                        continue
+                    lines = buffer[:end].split(b'\n')
+                    del buffer[:end + 1]
+                    try:
+                        for line in lines:
+                            if line:
+                                self.process_message(line)
+                    finally:
+                        self.flush_responses()
                 except json.JSONDecodeError as e:
                     logging.error(f"Invalid JSON: {e}")
                     continue
                 except Exception as e:
-                    logging.error(f"Error handling client: {e}")
-                    traceback.print_exc()
+                    logging.exception(f"Error handling client: {e}")
                     # Don't break here - try to continue handling client
                     time.sleep(0.1)
                     continue
         finally:
             logging.info(f"Client handler exiting: {self.client_address}")
     
-    def process_message(self, message_str):
+    def process_message(self, message_bytes):
         """Process a message from the client"""
         try:
-            message = json.loads(message_str)
+            message = json_loads(message_bytes)
             method = message.get("method", "")
             logging.info(f"Processing message: {method}")
             
-            if method == "initialize":
-                self.handle_initialize(message)
-            elif method == "tools/call":
-                self.handle_tool_call(message)
-            elif method == "shutdown":
-                self.handle_shutdown(message)
-            elif method == "notifications/cancelled":
-                logging.info("Received cancellation notification")
-            else:
-                logging.warning(f"Unknown method: {method}")
-                # Send error response for unknown methods
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": message.get("id", 0),
-                    "error": {
-                        "code": -32601,
-                        "message": f"Method '{method}' not found"
-                    }
-                }
-                self.send_response(response)
+            handler = self.METHOD_HANDLERS.get(method, MCPRequestHandler.handle_unknown_method)
+            handler(self, message)
         except Exception as e:
-            logging.error(f"Error processing message: {e}")
-            traceback.print_exc()
+            logging.exception(f"Error processing message: {e}")
             # Try to send error response
             try:
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": message.get("id", 0) if isinstance(message, dict) else 0,
-                    "error": {
-                        "code": -32603,
-                        "message": f"Internal error: {str(e)}"
-                    }
-                }
-                self.send_response(response)
+                request_id = message.get("id", 0) if isinstance(message, dict) else 0
+                self.send_response(error_response(request_id, -32603, f"Internal error: {str(e)}"))
             except:
                 pass
     
@@ -207,12 +190,8 @@ class MCPRequestHandler(socketserver.BaseRequestHandler):
         self.local_state = "initialized"
         logging.info("Server initialized successfully")
         
-        # Create response
-        response = {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": SERVER_CAPABILITIES
-        }
+        # Splice the request ID into the pre-serialized response
+        response = RESPONSE_PREFIX + encode_id(request_id) + INIT_RESPONSE_SUFFIX
         
         # Send response
         self.send_response(response)
@@ -229,15 +208,9 @@ class MCPRequestHandler(socketserver.BaseRequestHandler):
         logging.info(f"Executing tool: {tool_name}")
         
         # Return dummy success response
-        response = {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": {
-                "result": {"success": True, "message": f"Executed {tool_name} with parameters {parameters}"}
-            }
-        }
+        result = {"success": True, "message": f"Executed {tool_name} with parameters {parameters}"}
         
-        self.send_response(response)
+        self.send_response(tool_response(request_id, result))
     
     def handle_shutdown(self, request):
         """Handle shutdown request"""
@@ -245,29 +218,55 @@ class MCPRequestHandler(socketserver.BaseRequestHandler):
         logging.info("Shutdown requested by client")
         
         # Only shut down this client connection, not the entire server
-        response = {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": {"success": True}
-        }
+        response = shutdown_response(request_id)
         
         self.send_response(response)
         self.client_connected = False
     
+    def handle_cancelled(self, request):
+        """Handle cancellation notification"""
+        logging.info("Received cancellation notification")
+    
+    def handle_unknown_method(self, request):
+        """Send an error response for methods this server does not implement"""
+        method = request.get("method", "")
+        logging.warning(f"Unknown method: {method}")
+        self.send_response(error_response(request.get("id", 0), -32601, f"Method '{method}' not found"))
+    
     def send_response(self, data):
-        """Send JSON response to the client"""
+        """Queue a JSON response for the client
+        
+        data is either a response dict or an already serialized,
+        newline-terminated response as bytes. Queued responses are sent
+        by flush_responses once the current batch has been handled.
+        """
+        if isinstance(data, bytes):
+            self.pending += data
+        else:
+            self.pending += json_dumps_line(data)
+    
+    def flush_responses(self):
+        """Send all queued responses to the client in one call"""
+        if not self.pending:
+            return
+        
         try:
-            # Serialize to JSON and add newline
-            json_str = json.dumps(data) + "\n"
-            
-            # Send as bytes
-            self.request.sendall(json_str.encode('utf-8'))
-            logging.debug(f"Sent response: {json_str[:100]}...")
+            self.request.sendall(self.pending)
+            logging.debug("Sent responses: %.100s...", bytes(self.pending[:100]))
         except Exception as e:
-            logging.error(f"Error sending response: {e}")
-            traceback.print_exc()
+            logging.exception(f"Error sending response: {e}")
             # Don't close the connection on send error
             logging.info("Continuing despite send error")
+        finally:
+            self.pending.clear()
+    
+    # Dispatch table for incoming methods - one dict lookup per message
+    METHOD_HANDLERS = {
+        "initialize": handle_initialize,
+        "tools/call": handle_tool_call,
+        "shutdown": handle_shutdown,
+        "notifications/cancelled": handle_cancelled
+    }
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     """Threaded TCP Server that allows for multiple simultaneous connections"""
@@ -276,8 +275,6 @@ class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
 
 def signal_handler(sig, frame):
     """Handle termination signals"""
-    global EXIT_FLAG
-    
     logging.info(f"Received signal {sig}")
     
     # If server is in critical section, delay for a bit
@@ -285,8 +282,8 @@ def signal_handler(sig, frame):
         logging.info("Server is busy, delaying shutdown...")
         time.sleep(1)
     
-    # Set exit flag to trigger graceful shutdown
-    EXIT_FLAG = True
+    # Set exit event to trigger graceful shutdown
+    EXIT_EVENT.set()
 
 def cleanup():
     """Clean up resources when exiting"""
@@ -299,14 +296,11 @@ def cleanup():
 
 def main():
     """Main function"""
-    global EXIT_FLAG
-    
     # Register signal handlers
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     
     # Register cleanup handler
-    import atexit
     atexit.register(cleanup)
     
     logging.info("=== Daemon MCP Server Starting ===")
@@ -322,9 +316,8 @@ def main():
     server_thread.start()
     
     try:
-        # Keep the main thread running
-        while not EXIT_FLAG:
-            time.sleep(0.1)
+        # Keep the main thread parked until a signal handler requests shutdown
+        EXIT_EVENT.wait()
     except KeyboardInterrupt:
         logging.info("Keyboard interrupt received")
     finally:
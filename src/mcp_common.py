@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the standalone server, the daemon server and the socket proxy
+Logging setup, the JSON codec and the pre-encoded JSON-RPC response envelopes.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+# orjson is optional - when available it parses and serializes several times
+# faster than the stdlib json module and produces bytes directly
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def setup_logging(*handlers):
+    """Send log records through a queue to handlers run by a background listener
+
+    Callers never block on log I/O, and full formatting happens on the
+    listener thread.
+    """
+    log_queue = queue.SimpleQueue()
+    log_formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s')
+    for handler in handlers:
+        handler.setFormatter(log_formatter)
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(message)s',
+        handlers=[
+            logging.handlers.QueueHandler(log_queue)
+        ]
+    )
+
+# JSON codec for the request/response hot path, picked once at import
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps_bytes = orjson.dumps
+
+    def json_dumps_line(data):
+        """Serialize a response to newline-terminated JSON bytes"""
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+else:
+    json_loads = json.loads
+
+    def json_dumps_bytes(data):
+        """Serialize a value to JSON bytes without a trailing newline"""
+        return json.dumps(data).encode('utf-8')
+
+    def json_dumps_line(data):
+        """Serialize a response to newline-terminated JSON bytes"""
+        return (json.dumps(data) + "\n").encode('utf-8')
+
+# Responses are assembled from pre-encoded pieces, so only the parts that
+# change per request (ID, result, error message) are serialized
+RESPONSE_PREFIX = b'{"jsonrpc": "2.0", "id": '
+TOOL_RESPONSE_SEPARATOR = b', "result": {"result": '
+TOOL_RESPONSE_SUFFIX = b'}}\n'
+ERROR_RESPONSE_TEMPLATE = b'{"jsonrpc": "2.0", "id": %s, "error": {"code": %d, "message": %s}}\n'
+SHUTDOWN_RESPONSE_TEMPLATE = b'{"jsonrpc": "2.0", "id": %s, "result": {"success": true}}\n'
+
+def encode_id(request_id):
+    """Encode a JSON-RPC request ID, which may be a number or a string"""
+    return json.dumps(request_id).encode('utf-8')
+
+def init_response_suffix(capabilities):
+    """Serialize everything after the ID of an initialize response"""
+    return (', "result": ' + json.dumps(capabilities) + '}\n').encode('utf-8')
+
+def tool_response(request_id, result):
+    """Build a newline-terminated tool call response as bytes"""
+    return RESPONSE_PREFIX + encode_id(request_id) + TOOL_RESPONSE_SEPARATOR + json_dumps_bytes(result) + TOOL_RESPONSE_SUFFIX
+
+def error_response(request_id, code, message):
+    """Build a newline-terminated JSON-RPC error response as bytes"""
+    return ERROR_RESPONSE_TEMPLATE % (encode_id(request_id), code, json.dumps(message).encode('utf-8'))
+
+def shutdown_response(request_id):
+    """Build a newline-terminated shutdown response as bytes"""
+    return SHUTDOWN_RESPONSE_TEMPLATE % encode_id(request_id)
@@ -5,16 +5,18 @@ This script acts as a proxy between Claude Desktop and our daemon server.
 It forwards stdin to the daemon server and stdout back to Claude Desktop.
 """
 
-import json
 import os
+import re
 import socket
 import sys
 import time
 import logging
 import signal
-import traceback
 import subprocess
 import threading
+from contextlib import suppress
+
+from mcp_common import setup_logging
 
 # Configure logging - to file only, NOT stdout or stderr
 log_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,18 +24,36 @@ root_dir = os.path.dirname(log_dir)
 log_file = os.path.join(root_dir, "logs", "socket_proxy.log")
 os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler(log_file)
-    ]
-)
+setup_logging(logging.FileHandler(log_file))
+
+# Cheap substring checks used to spot the initialize handshake without parsing every message
+INITIALIZE_REQUEST = re.compile(rb'"method"\s*:\s*"initialize"')
+INITIALIZE_RESPONSE = b'"serverInfo"'
 
 # Global variables
 SERVER_PORT = 8765  # Must match port in daemon_mcp_server.py
-EXIT_FLAG = False
+EXIT_EVENT = threading.Event()  # Set when the proxy should shut down
 INITIALIZED = False  # Flag to track if we've been initialized
+THREAD_EXITED = threading.Event()  # Set whenever a forwarding thread exits, wakes the supervisor
+DAEMON_START_LOCK = threading.Lock()  # Only one thread at a time may check for and restart the daemon
+
+# Messages are relayed as raw bytes through large explicit buffers - stdin is read
+# in 64 KiB blocks and stdout is only flushed once per batch of complete messages
+STDIO_BUFFER_SIZE = 65536
+STDIN = os.fdopen(sys.stdin.fileno(), "rb", buffering=STDIO_BUFFER_SIZE, closefd=False)
+STDOUT = os.fdopen(sys.stdout.fileno(), "wb", buffering=STDIO_BUFFER_SIZE, closefd=False)
+
+def is_daemon_process(pid):
+    """Check that a live PID is our daemon and not an unrelated process that reused it"""
+    if not os.path.isdir("/proc/self"):
+        # No procfs (e.g. macOS) - the kill probe is the best we can do
+        return True
+    cmdline_path = f"/proc/{pid}/cmdline"
+    try:
+        with open(cmdline_path, 'rb') as f:
+            return b"daemon_mcp_server.py" in f.read()
+    except OSError:
+        return False
 
 def ensure_daemon_running():
     """Make sure the daemon server is running"""
@@ -48,15 +68,16 @@ def ensure_daemon_running():
             
             # Try to send signal 0 to check if process exists
             os.kill(pid, 0)
-            logging.info(f"Daemon server already running with PID {pid}")
-            return True
         except (OSError, ValueError):
             logging.info("Daemon server PID file exists but process is not running")
-            # Remove stale PID file
-            try:
-                os.remove(pid_file)
-            except:
-                pass
+        else:
+            if is_daemon_process(pid):
+                logging.info(f"Daemon server already running with PID {pid}")
+                return True
+            logging.info(f"Daemon server PID {pid} has been reused by another process")
+        # Remove stale PID file
+        with suppress(FileNotFoundError):
+            os.remove(pid_file)
     
     # Start the daemon server
     logging.info("Starting daemon server...")
@@ -64,21 +85,23 @@ def ensure_daemon_running():
         # Make daemon script executable
         os.chmod(daemon_path, 0o755)
         
-        # Start the daemon in the background
+        # Start the daemon in the background, in its own session so signals
+        # sent to the proxy's process group don't reach it
         subprocess.Popen(
             [daemon_path],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
             stdin=subprocess.DEVNULL,
-            cwd=os.path.dirname(os.path.abspath(__file__))
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            start_new_session=True
         )
         
         # Wait for the daemon to start
-        for _ in range(10):
+        for _ in range(100):
             if os.path.exists(pid_file):
                 logging.info("Daemon server started successfully")
                 return True
-            time.sleep(0.5)
+            time.sleep(0.05)
         
         logging.error("Timeout waiting for daemon server to start")
         return False
@@ -89,13 +112,17 @@ def ensure_daemon_running():
 def connect_to_daemon():
     """Connect to the daemon server"""
     for i in range(5):  # Try 5 times with exponential backoff
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.connect(('localhost', SERVER_PORT))
             logging.info("Connected to daemon server")
             return sock
         except (socket.error, ConnectionRefusedError) as e:
+            sock.close()
             logging.warning(f"Connection attempt {i+1} failed: {e}")
+            # The daemon may have died without removing its PID file - restart it if so
+            with DAEMON_START_LOCK:
+                ensure_daemon_running()
             time.sleep(2 ** i)  # Exponential backoff
     
     logging.error("Failed to connect to daemon server after multiple attempts")
@@ -107,48 +134,42 @@ def forward_stdin_to_socket(sock):
     logging.info("Starting stdin forwarding thread")
     
     try:
-        while not EXIT_FLAG:
+        while not EXIT_EVENT.is_set():
             try:
                 # Read a line from stdin
-                line = sys.stdin.readline()
+                line = STDIN.readline()
                 if not line:
                     if INITIALIZED:
                         logging.info("Stdin closed but initialized - staying alive")
-                        # Sleep longer to reduce log spam
-                        time.sleep(30)
-                        continue
+                        # Nothing more will arrive on stdin - park until shutdown instead of re-polling
+                        EXIT_EVENT.wait()
+                        break
                     else:
                         logging.info("Stdin closed")
                         break
                 
                 # Check if this is an initialize message
-                try:
-                    message = json.loads(line)
-                    if message.get("method") == "initialize":
-                        logging.info("Detected initialize message - will ignore termination signals")
-                        INITIALIZED = True
-                except:
-                    pass
+                if not INITIALIZED and INITIALIZE_REQUEST.search(line):
+                    logging.info("Detected initialize message - will ignore termination signals")
+                    INITIALIZED = True
                 
                 # Forward to socket with newline termination
                 try:
-                    sock.sendall(line.encode('utf-8'))
-                    logging.debug(f"Forwarded to socket: {line.strip()}")
+                    sock.sendall(line)
+                    logging.debug("Forwarded to socket: %s", line)
                 except socket.error as e:
                     logging.error(f"Socket error when forwarding stdin: {e}")
                     if INITIALIZED:
                         # If we're initialized, try to reconnect
                         logging.info("Trying to reconnect after socket error...")
-                        try:
+                        with suppress(OSError):
                             sock.close()
-                        except:
-                            pass
                         
                         new_sock = connect_to_daemon()
                         if new_sock:
                             sock = new_sock
                             # Re-send the original message that failed
-                            sock.sendall(line.encode('utf-8'))
+                            sock.sendall(line)
                             logging.info("Reconnected and resent message")
                         else:
                             logging.error("Failed to reconnect after socket error")
@@ -168,6 +189,7 @@ def forward_stdin_to_socket(sock):
         logging.error(f"Fatal error in stdin forwarding: {e}")
     finally:
         logging.info("Stdin forwarding thread exiting")
+        THREAD_EXITED.set()
 
 def forward_socket_to_stdout(sock):
     """Forward socket responses to stdout"""
@@ -176,7 +198,7 @@ def forward_socket_to_stdout(sock):
     
     buffer = b""
     try:
-        while not EXIT_FLAG:
+        while not EXIT_EVENT.is_set():
             try:
                 # Read data from socket
                 data = sock.recv(4096)
@@ -185,15 +207,12 @@ def forward_socket_to_stdout(sock):
                     if INITIALIZED:
                         # Try to reconnect
                         logging.info("Trying to reconnect to daemon server...")
-                        try:
+                        with suppress(OSError):
                             sock.close()
-                        except:
-                            pass
                             
                         new_sock = connect_to_daemon()
                         if new_sock:
                             sock = new_sock
-                            sock.settimeout(2.0)  # Make sure timeout is set on new socket
                             logging.info("Reconnected to daemon server")
                             continue
                         else:
@@ -206,43 +225,32 @@ def forward_socket_to_stdout(sock):
                 # Add to buffer
                 buffer += data
                 
-                # Process complete messages (assuming each message ends with newline)
-                while b'\n' in buffer:
-                    line, buffer = buffer.split(b'\n', 1)
-                    if line:
-                        # Forward to stdout
-                        line_str = line.decode('utf-8')
-                        
-                        # Check if this is an initialization response before forwarding
-                        try:
-                            response = json.loads(line_str)
-                            if isinstance(response, dict) and "jsonrpc" in response and "result" in response:
-                                if "serverInfo" in response.get("result", {}):
-                                    logging.info("Detected initialization response - setting INITIALIZED flag")
-                                    INITIALIZED = True
-                        except:
-                            pass
-                            
-                        # Always forward to stdout
-                        print(line_str, flush=True)
-                        logging.debug(f"Forwarded to stdout: {line_str}")
-            except socket.timeout:
-                # Just a timeout, not an error
-                continue
+                # Forward every complete message (each ends with a newline) in a single write
+                end = buffer.rfind(b'\n')
+                if end < 0:
+                    continue
+                complete, buffer = buffer[:end + 1], buffer[end + 1:]
+                
+                # Check if this is an initialization response before forwarding
+                if not INITIALIZED and INITIALIZE_RESPONSE in complete:
+                    logging.info("Detected initialization response - setting INITIALIZED flag")
+                    INITIALIZED = True
+                
+                # Always forward to stdout - raw bytes, no decode/re-encode round trip
+                STDOUT.write(complete)
+                STDOUT.flush()
+                logging.debug("Forwarded to stdout: %s", complete)
             except Exception as e:
                 logging.error(f"Error reading from socket: {e}")
                 if INITIALIZED:
                     # If we're initialized, try to reconnect
-                    try:
+                    with suppress(OSError):
                         sock.close()
-                    except:
-                        pass
                     
                     time.sleep(1)
                     new_sock = connect_to_daemon()
                     if new_sock:
                         sock = new_sock
-                        sock.settimeout(2.0)  # Make sure timeout is set on new socket
                         logging.info("Reconnected to daemon server after error")
                         continue
                     else:
@@ -256,20 +264,28 @@ def forward_socket_to_stdout(sock):
     finally:
         logging.info("Socket forwarding thread exiting")
         # If we're initialized, automatically restart the thread
-        if INITIALIZED and not EXIT_FLAG:
+        if INITIALIZED and not EXIT_EVENT.is_set():
             logging.info("Socket thread exited but we're initialized - restarting socket thread")
             time.sleep(1)  # Brief pause before reconnecting
             new_sock = connect_to_daemon()
             if new_sock:
-                new_sock.settimeout(2.0)  # Make sure timeout is set on new socket
                 new_thread = threading.Thread(target=forward_socket_to_stdout, args=(new_sock,))
                 new_thread.daemon = True
                 new_thread.start()
+        THREAD_EXITED.set()
+
+def threads_finished(*threads):
+    """Check whether all forwarding threads have exited.
+    
+    A thread signals THREAD_EXITED from its finally clause, just before it
+    actually terminates, so give each one a short grace period to finish.
+    """
+    for thread in threads:
+        thread.join(timeout=1.0)
+    return not any(thread.is_alive() for thread in threads)
 
 def signal_handler(sig, frame):
     """Handle termination signals"""
-    global EXIT_FLAG
-    
     logging.info(f"Received signal {sig}")
     
     # If initialized, ignore termination signals
@@ -279,12 +295,11 @@ def signal_handler(sig, frame):
     
     # Otherwise, exit normally
     logging.info(f"Exiting due to signal {sig}")
-    EXIT_FLAG = True
+    EXIT_EVENT.set()
+    THREAD_EXITED.set()
 
 def main():
     """Main function"""
-    global EXIT_FLAG
-    
     # Register signal handlers
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
@@ -309,9 +324,6 @@ def main():
             logging.error("Failed to connect to daemon server")
             return 1
         
-        # Set a timeout for the socket to prevent blocking indefinitely
-        sock.settimeout(2.0)
-        
         # Start forwarding threads
         stdin_thread = threading.Thread(target=forward_stdin_to_socket, args=(sock,))
         stdin_thread.daemon = True
@@ -321,9 +333,13 @@ def main():
         socket_thread.daemon = True
         socket_thread.start()
         
-        # Stay alive forever once initialized
-        while not EXIT_FLAG:
-            if not stdin_thread.is_alive() and not socket_thread.is_alive():
+        # Stay alive forever once initialized - sleep until a forwarding thread exits
+        while not EXIT_EVENT.is_set():
+            THREAD_EXITED.wait()
+            THREAD_EXITED.clear()
+            if EXIT_EVENT.is_set():
+                break
+            if threads_finished(stdin_thread, socket_thread):
                 if INITIALIZED:
                     logging.info("Both threads exited but we're initialized - restarting threads")
                     # Create a new socket and restart threads
@@ -340,36 +356,36 @@ def main():
                     else:
                         # If reconnection fails, sleep and retry
                         time.sleep(10)
+                        THREAD_EXITED.set()
                 else:
                     logging.info("Both threads exited and not initialized - exiting")
                     break
-            time.sleep(0.1)
     except KeyboardInterrupt:
         logging.info("Keyboard interrupt received")
     except Exception as e:
-        logging.error(f"Unexpected error in main thread: {e}")
-        traceback.print_exc(file=logging.FileHandler(log_file))
+        logging.exception(f"Unexpected error in main thread: {e}")
     finally:
-        EXIT_FLAG = True
+        EXIT_EVENT.set()
         logging.info("Shutting down...")
-        try:
-            # Only remove PID file if not initialized
-            if not INITIALIZED and os.path.exists(pid_file):
+        # Only remove PID file if not initialized
+        if not INITIALIZED:
+            with suppress(FileNotFoundError):
                 os.remove(pid_file)
-        except:
-            pass
     
     # If we're initialized, we'll stay alive forever
     if INITIALIZED:
         logging.info("Staying alive after initialization")
-        # Reset EXIT_FLAG since we want to continue running
-        EXIT_FLAG = False
+        # Clear EXIT_EVENT since we want to continue running
+        EXIT_EVENT.clear()
         
-        # Enter a loop that attempts to reconnect to the daemon periodically
+        # Enter a loop that reconnects to the daemon whenever a forwarding thread exits
         while True:
             try:
-                if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), "daemon_server.pid")):
-                    logging.info("Daemon server PID file not found - attempting to restart daemon")
+                THREAD_EXITED.clear()
+                
+                # Restart the daemon if it is gone - this also catches a stale PID
+                # file left behind by a daemon that was killed
+                with DAEMON_START_LOCK:
                     ensure_daemon_running()
                 
                 # Check if we need to reconnect and restart threads
@@ -389,7 +405,12 @@ def main():
                             socket_thread.daemon = True
                             socket_thread.start()
                 
-                time.sleep(10)  # Check every 10 seconds
+                # Sleep until a forwarding thread exits - only retry on a timer while a restart is pending
+                threads_alive = stdin_thread.is_alive() and socket_thread.is_alive()
+                if THREAD_EXITED.wait(None if threads_alive else 10):
+                    # The thread signals just before it terminates, give it a moment to finish
+                    stdin_thread.join(timeout=0.1)
+                    socket_thread.join(timeout=0.1)
             except Exception as e:
                 logging.error(f"Error in reconnection loop: {e}")
                 time.sleep(30)  # Longer sleep on error
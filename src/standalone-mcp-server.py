@@ -5,16 +5,21 @@ This script implements a direct MCP server that communicates with both Claude an
 without any complex piping or shell scripts.
 """
 
-import json
+import io
 import os
 import socket
 import sys
 import time
+import atexit
 import logging
+import selectors
 import signal
 import threading
-import traceback
-from datetime import datetime
+
+from mcp_common import (
+    RESPONSE_PREFIX, encode_id, error_response, init_response_suffix,
+    json_dumps_line, json_loads, setup_logging, shutdown_response, tool_response
+)
 
 # Configure logging to stderr and file
 log_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,35 +27,135 @@ root_dir = os.path.dirname(log_dir)
 log_file = os.path.join(root_dir, "logs", "standalone_mcp_server.log")
 os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-# Configure logging to stderr only
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] [%(levelname)s] %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stderr),
-        logging.FileHandler(log_file)
-    ]
-)
+setup_logging(logging.StreamHandler(sys.stderr), logging.FileHandler(log_file, delay=True))
 
 # Global variables
 EXIT_FLAG = False
 SERVER_STATE = "waiting"  # States: waiting, initialized, processing
 
+# Stdin is read in blocks and framed by hand rather than line by line
+STDIN_FD = sys.stdin.fileno()
+STDIN_READ_SIZE = 65536
+STDIN_BUFFER = bytearray()
+# Readiness on stdin and on the signal wakeup pipe is awaited with epoll/kqueue
+# rather than sleeping between reads. Windows can only select on sockets, so
+# stdin is read with plain blocking reads there instead.
+USE_SELECTOR = sys.platform != "win32"
+SELECTOR = selectors.DefaultSelector()
+
+# Responses are buffered and flushed once per batch of requests
+STDOUT = io.BufferedWriter(io.FileIO(sys.stdout.fileno(), 'wb', closefd=False), buffer_size=65536)
+
 # Create a PID file
 pid_file = os.path.join(root_dir, "logs", "standalone_server.pid")
 with open(pid_file, "w") as f:
     f.write(str(os.getpid()))
 
+# Tools configuration as compact definitions:
+# (name, description, ((parameter, type, required, description), ...))
+TOOLS = (
+    ("geometry_tools.create_sphere", "Creates a sphere with the specified center and radius", (
+        ("centerX", "number", True, "X coordinate of the sphere center"),
+        ("centerY", "number", True, "Y coordinate of the sphere center"),
+        ("centerZ", "number", True, "Z coordinate of the sphere center"),
+        ("radius", "number", True, "Radius of the sphere"),
+        ("color", "string", False, "Optional color for the sphere (e.g., 'red', 'blue', etc.)"),
+    )),
+    ("geometry_tools.create_box", "Creates a box with the specified dimensions", (
+        ("cornerX", "number", True, "X coordinate of the box corner"),
+        ("cornerY", "number", True, "Y coordinate of the box corner"),
+        ("cornerZ", "number", True, "Z coordinate of the box corner"),
+        ("width", "number", True, "Width of the box (X dimension)"),
+        ("depth", "number", True, "Depth of the box (Y dimension)"),
+        ("height", "number", True, "Height of the box (Z dimension)"),
+        ("color", "string", False, "Optional color for the box (e.g., 'red', 'blue', etc.)"),
+    )),
+    ("geometry_tools.create_cylinder", "Creates a cylinder with the specified base point, height, and radius", (
+        ("baseX", "number", True, "X coordinate of the cylinder base point"),
+        ("baseY", "number", True, "Y coordinate of the cylinder base point"),
+        ("baseZ", "number", True, "Z coordinate of the cylinder base point"),
+        ("height", "number", True, "Height of the cylinder"),
+        ("radius", "number", True, "Radius of the cylinder"),
+        ("color", "string", False, "Optional color for the cylinder (e.g., 'red', 'blue', etc.)"),
+    )),
+    ("scene_tools.get_scene_info", "Gets information about objects in the current scene", ()),
+    ("scene_tools.clear_scene", "Clears all objects from the current scene", (
+        ("currentLayerOnly", "boolean", False, "If true, only delete objects on the current layer"),
+    )),
+    ("scene_tools.create_layer", "Creates a new layer in the Rhino document", (
+        ("name", "string", True, "Name of the new layer"),
+        ("color", "string", False, "Optional color for the layer (e.g., 'red', 'blue', etc.)"),
+    )),
+)
+
+def build_capabilities(tools):
+    """Expand the compact tool definitions into the initialize result"""
+    return {
+        "serverInfo": {
+            "name": "RhinoMcpServer",
+            "version": "0.1.0"
+        },
+        "capabilities": {
+            "tools": [
+                {
+                    "name": name,
+                    "description": description,
+                    "parameters": [
+                        {"name": param, "description": param_description, "required": required, "schema": {"type": param_type}}
+                        for param, param_type, required, param_description in parameters
+                    ]
+                }
+                for name, description, parameters in tools
+            ]
+        }
+    }
+
+# Static, so the initialize response is serialized once at import
+SERVER_CAPABILITIES = build_capabilities(TOOLS)
+
+INIT_RESPONSE_SUFFIX = init_response_suffix(SERVER_CAPABILITIES)
+
+def receive_messages():
+    """Read stdin in large blocks and split it into newline-delimited messages
+    
+    Returns the complete messages received so far as raw bytes (a burst of
+    messages costs a single read), or None once stdin is closed.
+    """
+    chunk = os.read(STDIN_FD, STDIN_READ_SIZE)
+    if not chunk:
+        if not STDIN_BUFFER:
+            return None
+        # Hand over a final message that was not newline-terminated
+        lines = [bytes(STDIN_BUFFER)]
+        STDIN_BUFFER.clear()
+        return lines
+    
+    STDIN_BUFFER.extend(chunk)
+    end = STDIN_BUFFER.rfind(b"\n")
+    if end < 0:
+        return []
+    
+    # isspace() stops at the first non-blank byte and, unlike strip(), allocates nothing
+    lines = [line for line in STDIN_BUFFER[:end].split(b"\n") if line and not line.isspace()]
+    del STDIN_BUFFER[:end + 1]
+    return lines
+
 def send_json_response(data):
-    """Send a JSON response to stdout (Claude)"""
+    """Send a JSON response to stdout (Claude)
+    
+    data is either a response dict or an already serialized,
+    newline-terminated response as bytes. The response is buffered;
+    the main loop flushes once it has handled the current batch.
+    """
     try:
-        # Ensure we're sending a valid JSON object
-        json_str = json.dumps(data)
+        if isinstance(data, bytes):
+            payload = data
+        else:
+            payload = json_dumps_line(data)
         
-        # Write as plain text to stdout
-        print(json_str, flush=True)
+        STDOUT.write(payload)
         
-        logging.debug(f"Sent JSON response: {json_str[:100]}...")
+        logging.debug("Sent JSON response: %.100s...", payload)
     except Exception as e:
         logging.error(f"Error sending JSON: {str(e)}")
 
@@ -61,77 +166,8 @@ def handle_initialize(request):
     # Get request ID from the client (default to 0 if not provided)
     request_id = request.get("id", 0)
     
-    # Return hard-coded initialization response with tools
-    response = {
-        "jsonrpc": "2.0",
-        "id": request_id,
-        "result": {
-            "serverInfo": {
-                "name": "RhinoMcpServer",
-                "version": "0.1.0"
-            },
-            "capabilities": {
-                "tools": [
-                    {
-                        "name": "geometry_tools.create_sphere",
-                        "description": "Creates a sphere with the specified center and radius",
-                        "parameters": [
-                            {"name": "centerX", "description": "X coordinate of the sphere center", "required": True, "schema": {"type": "number"}},
-                            {"name": "centerY", "description": "Y coordinate of the sphere center", "required": True, "schema": {"type": "number"}},
-                            {"name": "centerZ", "description": "Z coordinate of the sphere center", "required": True, "schema": {"type": "number"}},
-                            {"name": "radius", "description": "Radius of the sphere", "required": True, "schema": {"type": "number"}},
-                            {"name": "color", "description": "Optional color for the sphere (e.g., 'red', 'blue', etc.)", "required": False, "schema": {"type": "string"}}
-                        ]
-                    },
-                    {
-                        "name": "geometry_tools.create_box",
-                        "description": "Creates a box with the specified dimensions",
-                        "parameters": [
-                            {"name": "cornerX", "description": "X coordinate of the box corner", "required": True, "schema": {"type": "number"}},
-                            {"name": "cornerY", "description": "Y coordinate of the box corner", "required": True, "schema": {"type": "number"}},
-                            {"name": "cornerZ", "description": "Z coordinate of the box corner", "required": True, "schema": {"type": "number"}},
-                            {"name": "width", "description": "Width of the box (X dimension)", "required": True, "schema": {"type": "number"}},
-                            {"name": "depth", "description": "Depth of the box (Y dimension)", "required": True, "schema": {"type": "number"}},
-                            {"name": "height", "description": "Height of the box (Z dimension)", "required": True, "schema": {"type": "number"}},
-                            {"name": "color", "description": "Optional color for the box (e.g., 'red', 'blue', etc.)", "required": False, "schema": {"type": "string"}}
-                        ]
-                    },
-                    {
-                        "name": "geometry_tools.create_cylinder",
-                        "description": "Creates a cylinder with the specified base point, height, and radius",
-                        "parameters": [
-                            {"name": "baseX", "description": "X coordinate of the cylinder base point", "required": True, "schema": {"type": "number"}},
-                            {"name": "baseY", "description": "Y coordinate of the cylinder base point", "required": True, "schema": {"type": "number"}},
-                            {"name": "baseZ", "description": "Z coordinate of the cylinder base point", "required": True, "schema": {"type": "number"}},
-                            {"name": "height", "description": "Height of the cylinder", "required": True, "schema": {"type": "number"}},
-                            {"name": "radius", "description": "Radius of the cylinder", "required": True, "schema": {"type": "number"}},
-                            {"name": "color", "description": "Optional color for the cylinder (e.g., 'red', 'blue', etc.)", "required": False, "schema": {"type": "string"}}
-                        ]
-                    },
-                    {
-                        "name": "scene_tools.get_scene_info",
-                        "description": "Gets information about objects in the current scene",
-                        "parameters": []
-                    },
-                    {
-                        "name": "scene_tools.clear_scene",
-                        "description": "Clears all objects from the current scene",
-                        "parameters": [
-                            {"name": "currentLayerOnly", "description": "If true, only delete objects on the current layer", "required": False, "schema": {"type": "boolean"}}
-                        ]
-                    },
-                    {
-                        "name": "scene_tools.create_layer",
-                        "description": "Creates a new layer in the Rhino document",
-                        "parameters": [
-                            {"name": "name", "description": "Name of the new layer", "required": True, "schema": {"type": "string"}},
-                            {"name": "color", "description": "Optional color for the layer (e.g., 'red', 'blue', etc.)", "required": False, "schema": {"type": "string"}}
-                        ]
-                    }
-                ]
-            }
-        }
-    }
+    # Splice the request ID into the pre-serialized response
+    response = RESPONSE_PREFIX + encode_id(request_id) + INIT_RESPONSE_SUFFIX
     
     # Mark server as initialized
     global SERVER_STATE
@@ -150,15 +186,9 @@ def handle_tool_call(request):
     
     # Here you would actually implement the tool functionality
     # For this example, we just return a dummy success response
-    response = {
-        "jsonrpc": "2.0",
-        "id": request_id,
-        "result": {
-            "result": {"success": True, "message": f"Executed {tool_name} with parameters {parameters}"}
-        }
-    }
+    result = {"success": True, "message": f"Executed {tool_name} with parameters {parameters}"}
     
-    return response
+    return tool_response(request_id, result)
 
 def handle_shutdown(request):
     """Handle a shutdown request"""
@@ -168,41 +198,45 @@ def handle_shutdown(request):
     global EXIT_FLAG
     EXIT_FLAG = True
     
-    response = {
-        "jsonrpc": "2.0",
-        "id": request_id,
-        "result": {"success": True}
-    }
+    return shutdown_response(request_id)
+
+def handle_cancelled(request):
+    """Handle a cancellation notification"""
+    # Just acknowledge and continue
+    logging.info("Received cancellation notification")
+    return None
+
+def handle_unknown_method(request):
+    """Handle a method this server does not implement"""
+    method = request.get("method", "")
+    logging.warning(f"Unknown method: {method}")
     
-    return response
+    # Notifications carry no ID and must not be answered
+    if "id" not in request:
+        return None
+    
+    return error_response(request["id"], -32601, f"Method '{method}' not found")
+
+# Dispatch table for incoming methods - one dict lookup per message
+METHOD_HANDLERS = {
+    "initialize": handle_initialize,
+    "tools/call": handle_tool_call,
+    "shutdown": handle_shutdown,
+    "notifications/cancelled": handle_cancelled
+}
 
 def process_message(message):
     """Process a single message from the client."""
     try:
-        method = message.get("method", "")
-        
-        if method == "initialize":
-            response = handle_initialize(message)
-            send_json_response(response)
-            return True
-        elif method == "tools/call":
-            response = handle_tool_call(message)
+        handler = METHOD_HANDLERS.get(message.get("method", ""), handle_unknown_method)
+        response = handler(message)
+        if response is not None:
             send_json_response(response)
-            return True
-        elif method == "shutdown":
-            response = handle_shutdown(message)
-            send_json_response(response)
-            return False
-        elif method == "notifications/cancelled":
-            # Just acknowledge and continue
-            logging.info("Received cancellation notification")
-            return True
-        else:
-            logging.warning(f"Unknown method: {method}")
-            return True
+        
+        # Stop after a shutdown request
+        return handler is not handle_shutdown
     except Exception as e:
-        logging.error(f"Error processing message: {e}")
-        traceback.print_exc(file=sys.stderr)
+        logging.exception(f"Error processing message: {e}")
         return True  # Keep running even on errors
 
 def cleanup():
@@ -238,44 +272,70 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     
     # Register cleanup handler
-    import atexit
     atexit.register(cleanup)
     
     logging.info("=== MCP Server Starting ===")
     logging.info(f"Process ID: {os.getpid()}")
     
+    if USE_SELECTOR:
+        # Signals write a byte to this pipe, so a select blocked on stdin wakes up
+        # as soon as a handler has run and EXIT_FLAG can be checked straight away
+        signal_read_fd, signal_write_fd = os.pipe()
+        os.set_blocking(signal_read_fd, False)
+        os.set_blocking(signal_write_fd, False)
+        signal.set_wakeup_fd(signal_write_fd)
+        
+        SELECTOR.register(STDIN_FD, selectors.EVENT_READ)
+        SELECTOR.register(signal_read_fd, selectors.EVENT_READ)
+    
+    stdin_open = True
     try:
         # Main loop
         while not EXIT_FLAG:
             try:
-                # Read a line from stdin
-                line = input()
-                if not line:
-                    time.sleep(0.1)
+                if USE_SELECTOR:
+                    # Block until stdin is readable or a signal arrives
+                    ready = [key.fd for key, _ in SELECTOR.select()]
+                    if signal_read_fd in ready:
+                        os.read(signal_read_fd, 512)
+                        continue
+                elif not stdin_open:
+                    # Nothing left to read - just wake up now and then to check EXIT_FLAG
+                    time.sleep(1)
                     continue
                 
-                # Parse the JSON message
-                try:
-                    message = json.loads(line)
-                    # Process the message
-                    if not process_message(message):
+                # Read all complete messages currently available on stdin
+                lines = receive_messages()
+                if lines is None:
+                    # If we're initialized, keep running even if stdin is closed
+                    if SERVER_STATE == "initialized":
+                        logging.info("Stdin closed but server is initialized - staying alive")
+                        if USE_SELECTOR:
+                            SELECTOR.unregister(STDIN_FD)
+                        stdin_open = False
+                        continue
+                    else:
+                        logging.info("Stdin closed, exiting...")
                         break
-                except json.JSONDecodeError as e:
-                    logging.error(f"Invalid JSON received: {e}")
-                    continue
-            except EOFError:
-                # If we're initialized, keep running even if stdin is closed
-                if SERVER_STATE == "initialized":
-                    logging.info("Stdin closed but server is initialized - staying alive")
-                    # Sleep to avoid tight loop if stdin is permanently closed
-                    time.sleep(5)
-                    continue
-                else:
-                    logging.info("Stdin closed, exiting...")
-                    break
+                
+                try:
+                    for line in lines:
+                        # Parse the JSON message
+                        try:
+                            message = json_loads(line)
+                        except ValueError as e:
+                            # JSONDecodeError, or UnicodeDecodeError from json.loads on bad bytes
+                            logging.error(f"Invalid JSON received: {e}")
+                            continue
+                        
+                        # Process the message - a shutdown request also sets EXIT_FLAG
+                        if not process_message(message):
+                            break
+                finally:
+                    # One write to the pipe for the whole batch of responses
+                    STDOUT.flush()
             except Exception as e:
-                logging.error(f"Error in main loop: {e}")
-                traceback.print_exc(file=sys.stderr)
+                logging.exception(f"Error in main loop: {e}")
                 time.sleep(1)
     finally:
         logging.info("Server shutting down...")